@@ -4,6 +4,10 @@ from flask_socketio import SocketIO
 
 import config
 import torrent_manager
+import commands
+import storage_tiers
+import deletion_jobs
+import io_profiles
 import socket_handlers
 import routes
 
@@ -20,12 +24,24 @@ def create_app():
     # Initialize torrent manager
     torrent_manager.init_app(socketio)
     
+    # Initialize the control command queue
+    commands.init_app(socketio)
+    
+    # Initialize storage tier migrations
+    storage_tiers.init_app(socketio)
+    
+    # Initialize background deletion jobs
+    deletion_jobs.init_app(socketio)
+    
     # Initialize Socket.IO event handlers
     socket_handlers.init_socketio(socketio)
     
     # Initialize routes
     routes.init_routes(app, socketio)
     
+    # Initialize CLI commands
+    io_profiles.init_cli(app)
+    
     return app, socketio
 
 # Create the application
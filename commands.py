@@ -0,0 +1,247 @@
+# commands.py - Control command queue consumed by the torrent engine threads
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import libtorrent as lt
+
+import config
+
+socketio = None
+
+ACTIONS = ('pause', 'resume', 'force_recheck', 'reprioritize', 'move_storage')
+
+# Pending commands per torrent, drained by the thread that owns the handle
+_queues = {}
+# move_storage commands waiting for their storage alert, by torrent
+_pending_moves = {}
+# Recent commands by id, kept so clients can poll for the acknowledgement
+commands = OrderedDict()
+# Latency metrics per action
+metrics = {action: {'count': 0, 'failed': 0, 'total_ms': 0.0, 'max_ms': 0.0} for action in ACTIONS}
+_lock = threading.Lock()
+_command_ids = itertools.count(1)
+
+def init_app(app_socketio):
+    """Initialize the command queue with the app's SocketIO instance"""
+    global socketio
+    socketio = app_socketio
+
+
+class CommandError(Exception):
+    """Raised when a command cannot be queued or applied"""
+
+
+class Command:
+    """A control action for one torrent and its acknowledgement"""
+    __slots__ = ('command_id', 'torrent_id', 'action', 'args', 'status', 'error',
+                 'submitted_at', 'applied_at')
+
+    def __init__(self, command_id, torrent_id, action, args):
+        self.command_id = command_id
+        self.torrent_id = torrent_id
+        self.action = action
+        self.args = args
+        self.status = 'queued'
+        self.error = None
+        self.submitted_at = time.perf_counter()
+        self.applied_at = None
+
+    @property
+    def latency_ms(self):
+        if self.applied_at is None:
+            return None
+        return round((self.applied_at - self.submitted_at) * 1000, 3)
+
+    def to_dict(self):
+        """Convert the command to a JSON-serializable dict"""
+        data = {
+            'command_id': self.command_id,
+            'torrent_id': self.torrent_id,
+            'action': self.action,
+            'status': self.status,
+            'latency_ms': self.latency_ms
+        }
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+def open_queue(torrent_id):
+    """Start accepting commands for a torrent whose engine thread is running"""
+    with _lock:
+        _queues.setdefault(torrent_id, queue.Queue())
+
+def close_queue(torrent_id, reason='Torrent is no longer running'):
+    """Stop accepting commands for a torrent and fail anything still pending"""
+    with _lock:
+        pending = _queues.pop(torrent_id, None)
+        move = _pending_moves.pop(torrent_id, None)
+    if move is not None:
+        _finish(move, CommandError(reason))
+    if pending is None:
+        return
+    while True:
+        try:
+            command = pending.get_nowait()
+        except queue.Empty:
+            break
+        _finish(command, CommandError(reason))
+
+def get_command(command_id):
+    with _lock:
+        return commands.get(command_id)
+
+def submit(torrent_id, action, args=None):
+    """Queue a command for a torrent's engine thread and return it"""
+    if action not in ACTIONS:
+        raise CommandError(f"Unknown action: {action}")
+    args = args or {}
+    if action == 'reprioritize' and not isinstance(args.get('file_priorities'), list):
+        raise CommandError('reprioritize requires a file_priorities list')
+    if action == 'move_storage' and not args.get('path'):
+        raise CommandError('move_storage requires a path')
+
+    with _lock:
+        pending = _queues.get(torrent_id)
+        if pending is None:
+            raise CommandError('Torrent is not running')
+        command = Command(f"cmd_{next(_command_ids)}", torrent_id, action, args)
+        commands[command.command_id] = command
+        while len(commands) > config.COMMAND_HISTORY_SIZE:
+            commands.popitem(last=False)
+        # Enqueue under the lock so close_queue either drains this command or
+        # has already rejected it; put() never blocks on an unbounded queue
+        pending.put(command)
+    return command
+
+def process(torrent_id, handle, timeout=0.1):
+    """Apply queued commands for a torrent, waiting up to timeout for the first one.
+
+    Called by the engine thread in place of its poll sleep, so a command is
+    applied as soon as it arrives instead of on the next tick.
+    """
+    with _lock:
+        pending = _queues.get(torrent_id)
+    if pending is None:
+        time.sleep(timeout)
+        return 0
+
+    applied = 0
+    try:
+        command = pending.get(timeout=timeout)
+    except queue.Empty:
+        return 0
+    while True:
+        try:
+            # Asynchronous commands are acknowledged later from handle_alerts
+            if not apply_command(handle, command):
+                _finish(command)
+        except Exception as e:
+            _finish(command, e)
+        applied += 1
+        try:
+            command = pending.get_nowait()
+        except queue.Empty:
+            return applied
+
+def resolve_storage_path(path):
+    """Resolve a move target, which must stay inside UPLOAD_FOLDER"""
+    base = os.path.abspath(config.UPLOAD_FOLDER)
+    target = os.path.abspath(os.path.join(base, path))
+    if target != base and not target.startswith(base + os.sep):
+        raise CommandError('Target path must be inside the download folder')
+    return target
+
+def apply_command(handle, command):
+    """Apply one command to a libtorrent handle. Runs on the engine thread.
+
+    Returns True when the command finishes asynchronously and will be
+    acknowledged once libtorrent reports the outcome.
+    """
+    if command.action == 'pause':
+        # Take the torrent out of the auto manager so it stays paused
+        handle.unset_flags(lt.torrent_flags.auto_managed)
+        handle.pause()
+    elif command.action == 'resume':
+        handle.resume()
+        handle.set_flags(lt.torrent_flags.auto_managed)
+    elif command.action == 'force_recheck':
+        handle.force_recheck()
+    elif command.action == 'reprioritize':
+        priorities = [int(p) for p in command.args['file_priorities']]
+        num_files = handle.torrent_file().files().num_files()
+        if len(priorities) != num_files:
+            raise CommandError(f"Expected {num_files} file priorities, got {len(priorities)}")
+        handle.prioritize_files(priorities)
+    elif command.action == 'move_storage':
+        target = resolve_storage_path(command.args['path'])
+        with _lock:
+            if command.torrent_id in _pending_moves:
+                raise CommandError('A storage move is already in progress')
+            _pending_moves[command.torrent_id] = command
+        try:
+            os.makedirs(target, exist_ok=True)
+            handle.move_storage(target)
+        except Exception:
+            with _lock:
+                _pending_moves.pop(command.torrent_id, None)
+            raise
+        return True
+    return False
+
+def move_in_progress(torrent_id):
+    """Whether a move_storage command for the torrent is still running"""
+    with _lock:
+        return torrent_id in _pending_moves
+
+def handle_alerts(torrent_id, alerts):
+    """Acknowledge asynchronous commands from the torrent's session alerts"""
+    for alert in alerts:
+        if isinstance(alert, lt.storage_moved_alert):
+            error = None
+        elif isinstance(alert, lt.storage_moved_failed_alert):
+            error = CommandError(alert.message())
+        else:
+            continue
+        with _lock:
+            move = _pending_moves.pop(torrent_id, None)
+        if move is not None:
+            _finish(move, error)
+
+def _finish(command, error=None):
+    """Record the outcome and latency of a command and acknowledge it"""
+    command.applied_at = time.perf_counter()
+    if error is None:
+        command.status = 'applied'
+    else:
+        command.status = 'failed'
+        command.error = str(error)
+        print(f"Command {command.command_id} ({command.action}) failed: {error}")
+
+    latency_ms = command.latency_ms
+    with _lock:
+        stats = metrics[command.action]
+        stats['count'] += 1
+        if error is not None:
+            stats['failed'] += 1
+        stats['total_ms'] += latency_ms
+        stats['max_ms'] = max(stats['max_ms'], latency_ms)
+
+    socketio.emit('command_ack', command.to_dict())
+
+def get_metrics():
+    """Return per-action command counts and latencies"""
+    with _lock:
+        return {
+            action: {
+                'count': stats['count'],
+                'failed': stats['failed'],
+                'avg_ms': round(stats['total_ms'] / stats['count'], 3) if stats['count'] else None,
+                'max_ms': round(stats['max_ms'], 3)
+            }
+            for action, stats in metrics.items()
+        }
@@ -5,7 +5,16 @@ SECRET_KEY = 'your_secret_key_here'
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads')
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024 
 
+METADATA_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metadata_cache')
+
+# Storage tiers: when SCRATCH_FOLDER is set (e.g. an NVMe mount), active downloads
+# write there and are migrated to UPLOAD_FOLDER (bulk storage) once complete
+SCRATCH_FOLDER = None
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(METADATA_CACHE_FOLDER, exist_ok=True)
+if SCRATCH_FOLDER:
+    os.makedirs(SCRATCH_FOLDER, exist_ok=True)
 
 DEFAULT_TORRENT_SETTINGS = {
     'listen_interfaces': '0.0.0.0:6881',
@@ -27,5 +36,64 @@ DHT_NODES = [
     ("router.utorrent.com", 6881)
 ]
 
+# DHT state persistence and bootstrap resolution
+DHT_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dht_state.dat')
+DHT_STATE_SAVE_INTERVAL = 300  # seconds
+DHT_BOOTSTRAP_TTL = 3600  # seconds to trust resolved bootstrap addresses
+
 # Timeouts
-METADATA_TIMEOUT = 60  
\ No newline at end of file
+METADATA_TIMEOUT = 60
+
+# Disk I/O tuning profiles (libtorrent settings pack values)
+# disk_io_read_mode / disk_io_write_mode: 0 = enable_os_cache, 2 = disable_os_cache, 3 = write_through
+IO_PROFILE = 'default'
+IO_PROFILES = {
+    'default': {},  # libtorrent defaults for every tuned setting
+    'hdd': {
+        'aio_threads': 4,
+        'hashing_threads': 2,
+        'max_queued_disk_bytes': 8 * 1024 * 1024,
+        'send_buffer_watermark': 1024 * 1024,
+        'disk_io_read_mode': 0,
+        'disk_io_write_mode': 0
+    },
+    'nvme': {
+        'aio_threads': 16,
+        'hashing_threads': 4,
+        'max_queued_disk_bytes': 64 * 1024 * 1024,
+        'send_buffer_watermark': 4 * 1024 * 1024,
+        'disk_io_read_mode': 0,
+        'disk_io_write_mode': 2
+    },
+    'network': {
+        'aio_threads': 8,
+        'hashing_threads': 2,
+        'max_queued_disk_bytes': 32 * 1024 * 1024,
+        'send_buffer_watermark': 2 * 1024 * 1024,
+        'disk_io_read_mode': 0,
+        'disk_io_write_mode': 0
+    }
+}
+
+# I/O calibration benchmark
+IO_CALIBRATION_SIZE_MB = 64
+IO_CALIBRATION_MAX_SIZE_MB = 1024  # largest size_mb the calibrate endpoint accepts
+IO_CALIBRATION_BLOCK_SIZE = 16 * 1024  # libtorrent block size
+IO_CALIBRATION_RANDOM_WRITES = 512
+
+# Importing existing data
+IMPORT_HASHING_THREADS = os.cpu_count() or 4
+IMPORT_MAX_HASHING_THREADS = os.cpu_count() or 4  # upper bound for the hashing_threads request field
+IMPORT_CHECKING_MEM_USAGE = 1024  # in 16 KiB blocks
+
+# Background deletion jobs
+DELETION_BATCH_SIZE = 500  # files removed between progress events
+DELETION_HISTORY_SIZE = 100  # finished jobs kept for polling
+
+# Control commands (pause, resume, recheck, reprioritize, move)
+COMMAND_HISTORY_SIZE = 1000  # acknowledged commands kept for polling
+
+# Scratch to bulk migration
+MIGRATION_RATE_LIMIT = 50 * 1024 * 1024  # bytes per second, 0 = unlimited
+MIGRATION_CHUNK_SIZE = 4 * 1024 * 1024
+MIGRATION_CLEANUP_DELAY = 30  # seconds to keep scratch copies for in-flight downloads
@@ -0,0 +1,138 @@
+# deletion_jobs.py - Background removal of completed torrent files
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import config
+from utils import cleanup_dir, run_blocking
+
+socketio = None
+
+# Recent deletion jobs by id, kept so clients can poll the result
+jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_job_ids = itertools.count(1)
+
+def init_app(app_socketio):
+    """Initialize the deletion jobs with the app's SocketIO instance"""
+    global socketio
+    socketio = app_socketio
+
+
+class DeletionJob:
+    """Progress of one background deletion"""
+    __slots__ = ('job_id', 'torrent_id', 'base_dir', 'paths', 'directories', 'folder', 'total',
+                 'status', 'deleted', 'failed', 'started_at', 'finished_at')
+
+    def __init__(self, job_id, torrent_id, base_dir, paths, directories, folder=None):
+        self.job_id = job_id
+        self.torrent_id = torrent_id
+        self.base_dir = base_dir
+        self.paths = paths
+        self.directories = directories
+        self.folder = folder
+        self.total = len(paths)
+        self.status = 'queued'
+        self.deleted = 0
+        self.failed = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        """Convert the job to a JSON-serializable dict"""
+        return {
+            'job_id': self.job_id,
+            'torrent_id': self.torrent_id,
+            'status': self.status,
+            'total': self.total,
+            'deleted': self.deleted,
+            'failed': self.failed,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+def emit_progress(job):
+    """Emit a socket.io event with deletion job progress"""
+    socketio.emit('deletion_progress', job.to_dict())
+
+def get_job(job_id):
+    with _jobs_lock:
+        return jobs.get(job_id)
+
+def submit(torrent_id, base_dir, entries, directories, folder=None):
+    """Start a background job deleting entries under base_dir and pruning directories. Returns the job."""
+    base_dir = base_dir or config.UPLOAD_FOLDER
+    with _jobs_lock:
+        job_id = f"delete_{next(_job_ids)}"
+        job = DeletionJob(job_id, torrent_id, base_dir, [entry.path for entry in entries], directories, folder)
+        jobs[job_id] = job
+        while len(jobs) > config.DELETION_HISTORY_SIZE:
+            jobs.popitem(last=False)
+    threading.Thread(target=run_job, args=(job,)).start()
+    return job
+
+def _remove_files(base_dir, paths):
+    """Remove a batch of files and return (deleted, failed)"""
+    deleted = failed = 0
+    for file_path in paths:
+        try:
+            os.remove(os.path.join(base_dir, file_path))
+            deleted += 1
+        except FileNotFoundError:
+            # Already gone, nothing to do
+            deleted += 1
+        except OSError as e:
+            print(f"Error deleting {file_path}: {e}")
+            failed += 1
+    return deleted, failed
+
+def _prune_directories(base_dir, directories, folder):
+    """Remove emptied directories, then any leftovers in a deleted folder"""
+    # Directories come deepest first, so parents are empty by the time we reach them
+    for directory in directories:
+        if not directory:
+            continue
+        try:
+            os.rmdir(os.path.join(base_dir, directory))
+        except OSError:
+            # Not empty or already removed, that's fine
+            pass
+
+    if folder:
+        # Match the old folder delete: also remove leftovers that were not part of the torrent
+        full_path = os.path.join(base_dir, folder)
+        if os.path.isdir(full_path):
+            cleanup_dir(full_path)
+
+def run_job(job):
+    """Delete the job's files in batches, then prune emptied directories once each"""
+    job.status = 'running'
+    job.started_at = time.time()
+    emit_progress(job)
+
+    try:
+        batch_size = config.DELETION_BATCH_SIZE
+        for start in range(0, len(job.paths), batch_size):
+            # Each batch runs in an OS thread so slow volumes never stall the eventlet hub
+            deleted, failed = run_blocking(_remove_files, job.base_dir, job.paths[start:start + batch_size])
+            job.deleted += deleted
+            job.failed += failed
+            emit_progress(job)
+            # Yield so the eventlet worker can serve other requests
+            time.sleep(0)
+
+        run_blocking(_prune_directories, job.base_dir, job.directories, job.folder)
+
+        job.status = 'completed' if not job.failed else 'completed_with_errors'
+    except Exception as e:
+        print(f"Error in deletion job {job.job_id}: {e}")
+        job.status = 'error'
+    finally:
+        job.finished_at = time.time()
+        # Only the counters are needed once the job is done
+        job.paths = ()
+        job.directories = ()
+        emit_progress(job)
@@ -0,0 +1,134 @@
+# dht_state.py - DHT routing table persistence and cached bootstrap resolution
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import libtorrent as lt
+
+import config
+
+# Bencoded DHT state loaded from disk or captured from a live session
+_state_data = None
+_state_lock = threading.Lock()
+# Serializes writers of DHT_STATE_FILE (the periodic saver and finishing downloads)
+_save_lock = threading.Lock()
+
+# Resolved bootstrap nodes as (ip, port) and when they were resolved
+_bootstrap_nodes = []
+_bootstrap_resolved_at = 0
+_resolving = False
+_bootstrap_lock = threading.Lock()
+
+def init_app(get_sessions):
+    """Load saved DHT state, start resolving bootstrap nodes and the periodic saver"""
+    load_state()
+    refresh_bootstrap_nodes()
+    threading.Thread(target=_save_loop, args=(get_sessions,), daemon=True).start()
+
+# Routing table state
+
+def load_state():
+    """Read the saved DHT state from disk into memory"""
+    global _state_data
+    try:
+        with open(config.DHT_STATE_FILE, 'rb') as f:
+            data = f.read()
+        with _state_lock:
+            _state_data = data
+        print(f"Loaded DHT state ({len(data)} bytes)")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Failed to load DHT state: {e}")
+
+def apply_state(session):
+    """Seed a new session's routing table with the saved DHT state"""
+    with _state_lock:
+        data = _state_data
+    if not data:
+        return False
+    try:
+        session.load_state(lt.bdecode(data), lt.save_state_flags_t.save_dht_state)
+        return True
+    except Exception as e:
+        print(f"Failed to apply DHT state: {e}")
+        return False
+
+def save_state(session):
+    """Capture a session's DHT state and write it to disk atomically"""
+    global _state_data
+    state = session.save_state(lt.save_state_flags_t.save_dht_state)
+    if not state:
+        # DHT not running, keep the last good state
+        return False
+
+    data = lt.bencode(state)
+    with _save_lock:
+        # Unique temp file in the same directory so os.replace stays atomic
+        fd, temp_path = tempfile.mkstemp(prefix='.dht_state_', dir=os.path.dirname(config.DHT_STATE_FILE))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, config.DHT_STATE_FILE)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        with _state_lock:
+            _state_data = data
+    return True
+
+def _save_loop(get_sessions):
+    """Periodically save the DHT state of a live session"""
+    while True:
+        time.sleep(config.DHT_STATE_SAVE_INTERVAL)
+        for session in get_sessions():
+            try:
+                if save_state(session):
+                    print("Saved DHT state")
+                    break
+            except Exception as e:
+                print(f"Failed to save DHT state: {e}")
+
+# Bootstrap node resolution
+
+def _resolve():
+    """Resolve config.DHT_NODES and cache the results"""
+    global _bootstrap_nodes, _bootstrap_resolved_at, _resolving
+    nodes = []
+    for hostname, port in config.DHT_NODES:
+        try:
+            ip = socket.gethostbyname(hostname)
+            print(f"Resolved DHT node: {hostname} ({ip}:{port})")
+            nodes.append((ip, port))
+        except Exception as e:
+            print(f"Failed to resolve DHT node {hostname}: {e}")
+
+    with _bootstrap_lock:
+        # Keep the previous addresses if every lookup failed
+        if nodes:
+            _bootstrap_nodes = nodes
+            _bootstrap_resolved_at = time.time()
+        _resolving = False
+
+def refresh_bootstrap_nodes():
+    """Start a background resolution of the bootstrap nodes if one is not running"""
+    global _resolving
+    with _bootstrap_lock:
+        if _resolving:
+            return
+        _resolving = True
+    threading.Thread(target=_resolve, daemon=True).start()
+
+def get_bootstrap_nodes():
+    """Return cached bootstrap addresses without blocking, refreshing them when stale"""
+    with _bootstrap_lock:
+        nodes = list(_bootstrap_nodes)
+        stale = time.time() - _bootstrap_resolved_at > config.DHT_BOOTSTRAP_TTL
+    if stale:
+        refresh_bootstrap_nodes()
+    return nodes
@@ -0,0 +1,184 @@
+# io_profiles.py - Disk I/O tuning profiles and volume calibration
+import hashlib
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+
+import click
+import libtorrent as lt
+from eventlet import patcher, tpool
+
+import config
+import storage_tiers
+
+# Settings the profiles tune; any a profile leaves out fall back to libtorrent's defaults
+TUNED_SETTINGS = (
+    'aio_threads', 'hashing_threads', 'max_queued_disk_bytes',
+    'send_buffer_watermark', 'disk_io_read_mode', 'disk_io_write_mode'
+)
+
+# Name of the profile applied to new and live sessions
+active_profile = config.IO_PROFILE
+# Per-volume adjustments from calibration, applied on top of the active profile
+active_overrides = {}
+
+# Result of the most recent calibration run, if any
+last_calibration = None
+
+_calibration_lock = threading.Lock()
+
+def get_settings(name=None):
+    """Return the libtorrent settings for a named profile.
+
+    Every tuned key is present, so applying a profile to a live session also
+    resets values an earlier profile changed.
+    """
+    overrides = active_overrides if name is None else {}
+    name = name or active_profile
+    if name not in config.IO_PROFILES:
+        raise ValueError(f"Unknown I/O profile: {name}")
+    defaults = lt.default_settings()
+    settings = {key: defaults[key] for key in TUNED_SETTINGS}
+    settings.update(config.IO_PROFILES[name])
+    settings.update(overrides)
+    return settings
+
+def apply_profile(name, sessions=(), overrides=None):
+    """Make name the active profile and apply it to the given live sessions"""
+    global active_profile, active_overrides
+    settings = get_settings(name)
+    settings.update(overrides or {})
+    active_profile = name
+    active_overrides = dict(overrides or {})
+
+    applied = 0
+    for session in sessions:
+        try:
+            session.apply_settings(settings)
+            applied += 1
+        except Exception as e:
+            print(f"Failed to apply I/O profile {name} to session: {e}")
+
+    print(f"I/O profile set to {name} ({applied} live sessions updated)")
+    return applied
+
+def _drop_cache(fd):
+    """Ask the kernel to drop cached pages so reads hit the device"""
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+def run_benchmark(directory=None, size_mb=None):
+    """Run a short write/read/hash benchmark on the volume holding directory"""
+    # New downloads, and so libtorrent's disk settings, hit the scratch tier when one is set
+    directory = directory or storage_tiers.download_root()
+    size_mb = size_mb or config.IO_CALIBRATION_SIZE_MB
+    block_size = config.IO_CALIBRATION_BLOCK_SIZE
+    total_bytes = size_mb * 1024 * 1024
+    num_blocks = total_bytes // block_size
+    block = os.urandom(block_size)
+
+    fd, path = tempfile.mkstemp(prefix='.io_calibration_', dir=directory)
+    try:
+        # Sequential write, flushed to the device
+        start = time.perf_counter()
+        for _ in range(num_blocks):
+            os.write(fd, block)
+        os.fsync(fd)
+        seq_write = time.perf_counter() - start
+
+        # Random block writes, like out-of-order piece arrival
+        offsets = [random.randrange(num_blocks) * block_size for _ in range(config.IO_CALIBRATION_RANDOM_WRITES)]
+        start = time.perf_counter()
+        for offset in offsets:
+            os.pwrite(fd, block, offset)
+        os.fsync(fd)
+        rand_write = time.perf_counter() - start
+
+        # Sequential read, hashing the data read back like a piece recheck
+        _drop_cache(fd)
+        hasher = hashlib.sha1()
+        seq_read = 0.0
+        hashing = 0.0
+        offset = 0
+        while offset < total_bytes:
+            start = time.perf_counter()
+            data = os.pread(fd, block_size, offset)
+            seq_read += time.perf_counter() - start
+            if not data:
+                break
+            start = time.perf_counter()
+            hasher.update(data)
+            hashing += time.perf_counter() - start
+            offset += len(data)
+    finally:
+        os.close(fd)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    return {
+        'directory': directory,
+        'size_mb': size_mb,
+        'seq_write_mbps': round(size_mb / max(seq_write, 1e-6), 1),
+        'seq_read_mbps': round(size_mb / max(seq_read, 1e-6), 1),
+        'random_write_iops': round(len(offsets) / max(rand_write, 1e-6)),
+        'hash_mbps': round(size_mb / max(hashing, 1e-6), 1)
+    }
+
+def recommend_hashing_threads(results):
+    """Use enough hashing threads for a recheck to keep up with the volume's read speed"""
+    threads = math.ceil(results['seq_read_mbps'] / max(results['hash_mbps'], 1e-6))
+    return max(1, min(threads, os.cpu_count() or 1))
+
+def recommend_profile(results):
+    """Pick the I/O profile that best fits the benchmark results"""
+    if results['random_write_iops'] >= 5000 and results['seq_write_mbps'] >= 500:
+        return 'nvme'
+    if results['seq_write_mbps'] < 80 or results['seq_read_mbps'] < 80:
+        # Slow even for sequential access, typical of network volumes
+        return 'network'
+    return 'hdd'
+
+def calibrate(directory=None, size_mb=None, apply=False, sessions=()):
+    """Benchmark the download volume and recommend (or apply) a profile"""
+    global last_calibration
+    with _calibration_lock:
+        if patcher.is_monkey_patched('thread'):
+            # Blocking file I/O and hashing would stall every green thread; use a real OS thread
+            results = tpool.execute(run_benchmark, directory, size_mb)
+        else:
+            results = run_benchmark(directory, size_mb)
+        results['recommended_profile'] = recommend_profile(results)
+        results['recommended_hashing_threads'] = recommend_hashing_threads(results)
+        results['applied'] = False
+        if apply:
+            apply_profile(
+                results['recommended_profile'], sessions,
+                overrides={'hashing_threads': results['recommended_hashing_threads']}
+            )
+            results['applied'] = True
+        results['timestamp'] = time.time()
+        last_calibration = results
+    print(f"I/O calibration: {results}")
+    return results
+
+def init_cli(app):
+    """Register the calibration command with the Flask CLI"""
+
+    @app.cli.command('calibrate-io')
+    @click.option('--directory', default=None, help='Volume to benchmark (defaults to the download volume)')
+    @click.option('--size-mb', default=None, type=int, help='Size of the benchmark file in MB')
+    def calibrate_io(directory, size_mb):
+        """Benchmark the download volume and print the recommended I/O profile"""
+        results = calibrate(directory, size_mb)
+        for key, value in results.items():
+            click.echo(f"{key}: {value}")
+        click.echo(f"Set IO_PROFILE = '{results['recommended_profile']}' in config.py, "
+                   f"or POST /api/io_profile/calibrate with apply=true on the running server")
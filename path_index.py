@@ -0,0 +1,134 @@
+# path_index.py - Prefix trie over a torrent's file paths
+import os
+
+
+def split_path(path):
+    """Split a torrent-relative path into its components"""
+    return [part for part in path.replace(os.sep, '/').split('/') if part]
+
+
+class _Node:
+    __slots__ = ('children', 'entry')
+
+    def __init__(self, children=None, entry=None):
+        self.children = {} if children is None else children
+        self.entry = entry
+
+    def copy(self):
+        return _Node(dict(self.children), self.entry)
+
+
+class PathIndex:
+    """Maps relative paths to file entries so folder lookups cost O(subtree).
+
+    An index is not modified once built; without() returns a new index that
+    shares every untouched branch with this one.
+    """
+
+    def __init__(self, entries=()):
+        self._root = _Node()
+        for entry in entries:
+            self.add(entry.path, entry)
+
+    def _find(self, parts):
+        node = self._root
+        for part in parts:
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def add(self, path, entry):
+        """Insert a file while building the index"""
+        node = self._root
+        for part in split_path(path):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = _Node()
+            node = child
+        node.entry = entry
+
+    def get(self, path):
+        """Return the entry for a file, or None"""
+        node = self._find(split_path(path))
+        return node.entry if node is not None else None
+
+    def is_empty(self):
+        return not self._root.children
+
+    def entries(self):
+        """Return every entry, in the order the files were added"""
+        entries = []
+        stack = [iter(self._root.children.values())]
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                continue
+            if node.entry is not None:
+                entries.append(node.entry)
+            if node.children:
+                stack.append(iter(node.children.values()))
+        return entries
+
+    def without(self, paths):
+        """Return a new index without the given files.
+
+        Only the nodes on the way to a removed file are copied, each at most
+        once, so this index (and any snapshot holding it) never changes and
+        removing a folder costs O(subtree) rather than O(torrent).
+        """
+        index = PathIndex()
+        index._root = self._root.copy()
+        copied = {id(index._root)}
+        for path in paths:
+            parts = split_path(path)
+            trail = [index._root]
+            for part in parts:
+                node = trail[-1].children.get(part)
+                if node is None:
+                    break
+                if id(node) not in copied:
+                    node = node.copy()
+                    copied.add(id(node))
+                    trail[-1].children[part] = node
+                trail.append(node)
+            else:
+                trail[-1].entry = None
+                # Prune branches left without files
+                for depth in range(len(parts), 0, -1):
+                    if trail[depth].children or trail[depth].entry is not None:
+                        break
+                    del trail[depth - 1].children[parts[depth - 1]]
+        return index
+    def files_under(self, folder):
+        """Return every entry below folder (not including a file named folder)"""
+        node = self._find(split_path(folder))
+        if node is None:
+            return []
+        entries = []
+        stack = list(node.children.values())
+        while stack:
+            node = stack.pop()
+            if node.entry is not None:
+                entries.append(node.entry)
+            stack.extend(node.children.values())
+        return entries
+
+    def directories_under(self, folder=''):
+        """Return relative directories below folder, deepest first, for pruning"""
+        base = split_path(folder)
+        node = self._find(base)
+        if node is None:
+            return []
+        directories = []
+        stack = [(node, base)]
+        while stack:
+            node, parts = stack.pop()
+            for name, child in node.children.items():
+                if child.children:
+                    child_parts = parts + [name]
+                    directories.append('/'.join(child_parts))
+                    stack.append((child, child_parts))
+        directories.sort(key=lambda d: d.count('/'), reverse=True)
+        return directories
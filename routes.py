@@ -6,7 +6,11 @@ import time
 from urllib.parse import unquote
 from flask import jsonify, render_template, request, send_file, abort
 
+import commands
 import config
+import deletion_jobs
+import io_profiles
+import storage_tiers
 import torrent_manager
 from utils import create_zip_file, encode_path_for_url, decode_path_from_url, cleanup_dir
 
@@ -48,20 +52,66 @@ def init_routes(app, socketio):
         except Exception as e:
             return jsonify({'status': 'error', 'message': str(e)})
 
+    @app.route('/api/import_torrent', methods=['POST'])
+    def import_torrent():
+        """API endpoint to adopt existing data in the download folder for a torrent"""
+        try:
+            torrent_id = f"torrent_{int(time.time())}"
+            hashing_threads = request.form.get('hashing_threads')
+            if hashing_threads:
+                try:
+                    hashing_threads = int(hashing_threads)
+                except ValueError:
+                    hashing_threads = 0
+                if hashing_threads < 1:
+                    return jsonify({'status': 'error', 'message': 'hashing_threads must be a positive integer'})
+                # More threads than cores only adds contention
+                hashing_threads = min(hashing_threads, config.IMPORT_MAX_HASHING_THREADS)
+            else:
+                hashing_threads = None
+            
+            if 'magnet' in request.form and request.form['magnet']:
+                magnet_link = request.form['magnet']
+                threading.Thread(
+                    target=torrent_manager.import_torrent,
+                    args=(torrent_id, magnet_link, None, hashing_threads)
+                ).start()
+                return jsonify({'status': 'success', 'torrent_id': torrent_id})
+            
+            elif 'torrent_file' in request.files:
+                torrent_file = request.files['torrent_file']
+                if torrent_file.filename == '':
+                    return jsonify({'status': 'error', 'message': 'No file selected'})
+                
+                temp_path = os.path.join(tempfile.gettempdir(), f"{torrent_id}.torrent")
+                torrent_file.save(temp_path)
+                threading.Thread(
+                    target=torrent_manager.import_torrent,
+                    args=(torrent_id, None, temp_path, hashing_threads)
+                ).start()
+                return jsonify({'status': 'success', 'torrent_id': torrent_id})
+            
+            return jsonify({'status': 'error', 'message': 'No valid torrent source provided'})
+        
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': str(e)})
+
     @app.route('/api/torrent_status/<torrent_id>', methods=['GET'])
     def get_torrent_status(torrent_id):
         """API endpoint to get the status of a torrent"""
-        if torrent_id in torrent_manager.active_torrents:
-            return jsonify({'status': 'active', 'data': torrent_manager.active_torrents[torrent_id]})
-        elif torrent_id in torrent_manager.completed_torrents:
-            return jsonify({'status': 'completed', 'data': torrent_manager.completed_torrents[torrent_id]})
+        snapshot = torrent_manager.store.snapshot()
+        if torrent_id in snapshot.active:
+            return jsonify({'status': 'active', 'data': snapshot.active[torrent_id].to_dict()})
+        elif torrent_id in snapshot.completed:
+            return jsonify({'status': 'completed', 'data': snapshot.completed[torrent_id].to_dict()})
         else:
             return jsonify({'status': 'not_found'})
 
     @app.route('/api/select_files/<torrent_id>', methods=['POST'])
     def select_files(torrent_id):
         """API endpoint to select which files to download"""
-        if torrent_id not in torrent_manager.active_torrents or torrent_manager.active_torrents[torrent_id]['status'] != 'selection':
+        record = torrent_manager.store.get_status(torrent_id)
+        if record is None or record.status != 'selection':
             return jsonify({'status': 'error', 'message': 'Torrent not in selection state'})
         
         try:
@@ -72,9 +122,9 @@ def init_routes(app, socketio):
             
             # Start the actual download with selected files
             # We need to make sure we have a session and handle
-            if torrent_id in torrent_manager.active_sessions and torrent_id in torrent_manager.active_handles:
-                session = torrent_manager.active_sessions[torrent_id]
-                handle = torrent_manager.active_handles[torrent_id]
+            engine = torrent_manager.store.get_engine(torrent_id)
+            if engine is not None:
+                session, handle = engine
                 
                 # Start a thread to do the actual download
                 threading.Thread(
@@ -99,25 +149,54 @@ def init_routes(app, socketio):
     @app.route('/api/cancel_torrent/<torrent_id>', methods=['POST'])
     def cancel_torrent(torrent_id):
         """API endpoint to cancel a torrent download"""
-        if torrent_id in torrent_manager.active_torrents:
-            # Clean up the session and handle if they exist
-            if torrent_id in torrent_manager.active_sessions and torrent_id in torrent_manager.active_handles:
-                try:
-                    session = torrent_manager.active_sessions[torrent_id]
-                    handle = torrent_manager.active_handles[torrent_id]
-                    session.remove_torrent(handle, True)
-                    del torrent_manager.active_sessions[torrent_id]
-                    del torrent_manager.active_handles[torrent_id]
-                    print(f"Cleaned up session and handle for {torrent_id}")
-                except Exception as e:
-                    print(f"Error cleaning up session: {e}")
+        record = torrent_manager.store.remove_active(torrent_id)
+        if record is not None:
+            # A running download thread notices the removal and tears down its own
+            # handle; only clean up here when no thread is polling the handle
+            if record.status not in torrent_manager.POLLED_STATUSES:
+                # Imported torrents point at adopted data, which is never deleted
+                keep_files = torrent_manager.store.keeps_files(torrent_id)
+                engine = torrent_manager.store.pop_engine(torrent_id)
+                if engine is not None:
+                    try:
+                        session, handle = engine
+                        session.remove_torrent(handle, not keep_files)
+                        print(f"Cleaned up session and handle for {torrent_id}")
+                    except Exception as e:
+                        print(f"Error cleaning up session: {e}")
             
-            del torrent_manager.active_torrents[torrent_id]
             # Emit update to all clients
             socketio.emit('torrent_removed', {'torrent_id': torrent_id})
             return jsonify({'status': 'success'})
         return jsonify({'status': 'error', 'message': 'Torrent not found'})
 
+    @app.route('/api/torrent_command/<torrent_id>', methods=['POST'])
+    def torrent_command(torrent_id):
+        """API endpoint to queue a pause, resume, force_recheck, reprioritize or move_storage command"""
+        try:
+            data = request.get_json(silent=True) or {}
+            command = commands.submit(torrent_id, data.get('action'), data.get('args'))
+            return jsonify({'status': 'success', 'command_id': command.command_id})
+        
+        except commands.CommandError as e:
+            return jsonify({'status': 'error', 'message': str(e)})
+        except Exception as e:
+            print(f"Error in torrent_command: {str(e)}")
+            return jsonify({'status': 'error', 'message': str(e)})
+
+    @app.route('/api/commands/<command_id>', methods=['GET'])
+    def get_command(command_id):
+        """API endpoint to get the acknowledgement for a queued command"""
+        command = commands.get_command(command_id)
+        if command is None:
+            return jsonify({'status': 'not_found'})
+        return jsonify({'status': 'success', 'command': command.to_dict()})
+
+    @app.route('/api/command_metrics', methods=['GET'])
+    def get_command_metrics():
+        """API endpoint to get command counts and apply latencies per action"""
+        return jsonify({'status': 'success', 'metrics': commands.get_metrics()})
+
     @app.route('/api/download_file', methods=['GET'])
     def download_file():
         """API endpoint to download a single file"""
@@ -125,10 +204,12 @@ def init_routes(app, socketio):
             torrent_id = request.args.get('torrent_id')
             file_path = unquote(request.args.get('file_path'))
             
-            if not torrent_id or not file_path or torrent_id not in torrent_manager.completed_torrents:
+            record = torrent_manager.store.get_completed(torrent_id) if torrent_id else None
+            if not file_path or record is None:
                 abort(404)
             
-            full_path = os.path.join(config.UPLOAD_FOLDER, file_path)
+            # Resolve against the torrent's current storage tier
+            full_path = os.path.join(record.save_path, file_path)
             
             if not os.path.exists(full_path) or not os.path.isfile(full_path):
                 abort(404)
@@ -145,11 +226,12 @@ def init_routes(app, socketio):
             torrent_id = request.json.get('torrent_id')
             file_paths = request.json.get('file_paths', [])
             
-            if not torrent_id or torrent_id not in torrent_manager.completed_torrents:
+            record = torrent_manager.store.get_completed(torrent_id) if torrent_id else None
+            if record is None:
                 return jsonify({'status': 'error', 'message': 'Invalid torrent ID'})
             
-            zip_filename = f"{torrent_manager.completed_torrents[torrent_id]['name']}.zip"
-            zip_path, temp_dir = create_zip_file(file_paths, config.UPLOAD_FOLDER, zip_filename)
+            zip_filename = f"{record.name}.zip"
+            zip_path, temp_dir = create_zip_file(file_paths, record.save_path, zip_filename)
             
             # Encode the path to be safe in URL
             encoded_path = encode_path_for_url(zip_path)
@@ -195,7 +277,7 @@ def init_routes(app, socketio):
     @app.route('/api/list_completed', methods=['GET'])
     def list_completed():
         """API endpoint to list all completed torrents"""
-        return jsonify({'status': 'success', 'torrents': torrent_manager.completed_torrents})
+        return jsonify({'status': 'success', 'torrents': torrent_manager.store.snapshot().completed_dict()})
 
     @app.route('/api/delete_file', methods=['POST'])
     def delete_file():
@@ -205,10 +287,11 @@ def init_routes(app, socketio):
             torrent_id = data.get('torrent_id')
             file_path = data.get('file_path')
             
-            if not torrent_id or not file_path or torrent_id not in torrent_manager.completed_torrents:
+            record = torrent_manager.store.get_completed(torrent_id) if torrent_id else None
+            if not file_path or record is None:
                 return jsonify({'status': 'error', 'message': 'Invalid torrent ID or file path'})
             
-            full_path = os.path.join(config.UPLOAD_FOLDER, file_path)
+            full_path = os.path.join(record.save_path, file_path)
             
             if not os.path.exists(full_path) or not os.path.isfile(full_path):
                 return jsonify({'status': 'error', 'message': 'File not found'})
@@ -216,20 +299,11 @@ def init_routes(app, socketio):
             # Delete the file
             os.remove(full_path)
             
-            # Update the completed torrents data
-            updated_files = []
-            for file_info in torrent_manager.completed_torrents[torrent_id]['files']:
-                if file_info['path'] != file_path:
-                    updated_files.append(file_info)
-            
-            torrent_manager.completed_torrents[torrent_id]['files'] = updated_files
-            
-            # If no files left, remove the torrent from completed list
-            if not updated_files:
-                del torrent_manager.completed_torrents[torrent_id]
+            # Update the completed torrents data (drops the torrent once no files are left)
+            torrent_manager.store.detach_files(torrent_id, paths=[file_path])
             
             # Emit event to update all clients
-            socketio.emit('completed_torrents_update', {'torrents': torrent_manager.completed_torrents})
+            torrent_manager.emit_completed_update()
             
             return jsonify({'status': 'success'})
         
@@ -245,34 +319,23 @@ def init_routes(app, socketio):
             torrent_id = data.get('torrent_id')
             folder_path = data.get('folder_path')
             
-            if not torrent_id or not folder_path or torrent_id not in torrent_manager.completed_torrents:
+            record = torrent_manager.store.get_completed(torrent_id) if torrent_id else None
+            if not folder_path or record is None:
                 return jsonify({'status': 'error', 'message': 'Invalid torrent ID or folder path'})
             
-            full_path = os.path.join(config.UPLOAD_FOLDER, folder_path)
+            full_path = os.path.join(record.save_path, folder_path)
             
             if not os.path.exists(full_path) or not os.path.isdir(full_path):
                 return jsonify({'status': 'error', 'message': 'Folder not found'})
             
-            # Delete the folder and all its contents
-            cleanup_dir(full_path)
-            
-            # Update the completed torrents data by removing files in that folder
-            updated_files = []
-            for file_info in torrent_manager.completed_torrents[torrent_id]['files']:
-                # Keep files that don't start with the folder path
-                if not file_info['path'].startswith(folder_path + '/'):
-                    updated_files.append(file_info)
-            
-            torrent_manager.completed_torrents[torrent_id]['files'] = updated_files
-            
-            # If no files left, remove the torrent from completed list
-            if not updated_files:
-                del torrent_manager.completed_torrents[torrent_id]
+            # Take the folder's files out of the library, then delete them in the background
+            entries, directories, save_path = torrent_manager.store.detach_files(torrent_id, folder=folder_path)
+            job = deletion_jobs.submit(torrent_id, save_path, entries, directories, folder=folder_path)
             
             # Emit event to update all clients
-            socketio.emit('completed_torrents_update', {'torrents': torrent_manager.completed_torrents})
+            torrent_manager.emit_completed_update()
             
-            return jsonify({'status': 'success'})
+            return jsonify({'status': 'success', 'job_id': job.job_id})
         
         except Exception as e:
             print(f"Error deleting folder: {str(e)}")
@@ -285,39 +348,99 @@ def init_routes(app, socketio):
             data = request.json
             torrent_id = data.get('torrent_id')
             
-            if not torrent_id or torrent_id not in torrent_manager.completed_torrents:
+            if not torrent_id or not torrent_manager.store.is_completed(torrent_id):
                 return jsonify({'status': 'error', 'message': 'Invalid torrent ID'})
             
-            # Get the list of file paths
-            file_paths = [file_info['path'] for file_info in torrent_manager.completed_torrents[torrent_id]['files']]
+            # Remove the torrent from the library, then delete its files in the background
+            entries, directories, save_path = torrent_manager.store.detach_files(torrent_id)
+            job = deletion_jobs.submit(torrent_id, save_path, entries, directories)
             
-            # Delete all files
-            for file_path in file_paths:
-                full_path = os.path.join(config.UPLOAD_FOLDER, file_path)
-                if os.path.exists(full_path) and os.path.isfile(full_path):
-                    os.remove(full_path)
-            
-            # Delete empty directories
-            for file_path in file_paths:
-                directory = os.path.dirname(file_path)
-                if directory:
-                    directory_full_path = os.path.join(config.UPLOAD_FOLDER, directory)
-                    try:
-                        # Try to delete the directory, will only succeed if empty
-                        if os.path.exists(directory_full_path):
-                            os.rmdir(directory_full_path)
-                    except OSError:
-                        # Directory not empty, that's fine
-                        pass
+            # Emit event to update all clients
+            torrent_manager.emit_completed_update()
             
-            # Remove the torrent from completed list
-            del torrent_manager.completed_torrents[torrent_id]
+            return jsonify({'status': 'success', 'job_id': job.job_id})
+        
+        except Exception as e:
+            print(f"Error deleting torrent: {str(e)}")
+            return jsonify({'status': 'error', 'message': str(e)})
+
+    @app.route('/api/io_profile', methods=['GET'])
+    def get_io_profile():
+        """API endpoint to get the active I/O profile and last calibration result"""
+        return jsonify({
+            'status': 'success',
+            'profile': io_profiles.active_profile,
+            'profiles': config.IO_PROFILES,
+            'calibration': io_profiles.last_calibration
+        })
+
+    @app.route('/api/io_profile', methods=['POST'])
+    def set_io_profile():
+        """API endpoint to apply an I/O profile to all live sessions"""
+        try:
+            profile = request.json.get('profile')
+            if profile not in config.IO_PROFILES:
+                return jsonify({'status': 'error', 'message': f"Unknown I/O profile: {profile}"})
             
-            # Emit event to update all clients
-            socketio.emit('completed_torrents_update', {'torrents': torrent_manager.completed_torrents})
+            applied = io_profiles.apply_profile(profile, torrent_manager.store.sessions())
+            return jsonify({'status': 'success', 'profile': profile, 'sessions_updated': applied})
+        
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': str(e)})
+
+    @app.route('/api/io_profile/calibrate', methods=['POST'])
+    def calibrate_io_profile():
+        """API endpoint to benchmark the download volume in the background"""
+        try:
+            data = request.get_json(silent=True) or {}
+            apply = data.get('apply', False)
+            if isinstance(apply, str):
+                apply = apply.strip().lower() in ('1', 'true', 'yes', 'on')
+            apply = bool(apply)
+            size_mb = data.get('size_mb')
+            if size_mb is not None:
+                try:
+                    size_mb = int(size_mb)
+                except (TypeError, ValueError):
+                    size_mb = 0
+                if size_mb < 1:
+                    return jsonify({'status': 'error', 'message': 'size_mb must be a positive integer'})
+                # The benchmark writes this much to the download volume
+                size_mb = min(size_mb, config.IO_CALIBRATION_MAX_SIZE_MB)
+            
+            def run():
+                try:
+                    results = io_profiles.calibrate(
+                        size_mb=size_mb,
+                        apply=apply,
+                        sessions=torrent_manager.store.sessions()
+                    )
+                    socketio.emit('io_calibration', {'status': 'success', 'results': results})
+                except Exception as e:
+                    print(f"Error during I/O calibration: {e}")
+                    socketio.emit('io_calibration', {'status': 'error', 'message': str(e)})
             
+            threading.Thread(target=run).start()
             return jsonify({'status': 'success'})
         
         except Exception as e:
-            print(f"Error deleting torrent: {str(e)}")
-            return jsonify({'status': 'error', 'message': str(e)})
\ No newline at end of file
+            return jsonify({'status': 'error', 'message': str(e)})
+
+    @app.route('/api/deletion_jobs/<job_id>', methods=['GET'])
+    def get_deletion_job(job_id):
+        """API endpoint to get the progress of a background deletion"""
+        job = deletion_jobs.get_job(job_id)
+        if job is None:
+            return jsonify({'status': 'not_found'})
+        return jsonify({'status': 'success', 'job': job.to_dict()})
+
+    @app.route('/api/storage_tiers', methods=['GET'])
+    def get_storage_tiers():
+        """API endpoint to get the storage tiers and running scratch-to-bulk migrations"""
+        return jsonify({
+            'status': 'success',
+            'download_tier': storage_tiers.tier_name(storage_tiers.download_root()),
+            'scratch_enabled': storage_tiers.scratch_root() is not None,
+            'migration_rate_limit': config.MIGRATION_RATE_LIMIT,
+            'migrations': storage_tiers.get_migrations()
+        })
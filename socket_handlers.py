@@ -9,9 +9,11 @@ def init_socketio(socketio):
         """Handle client connection"""
         print("Client connected")
         # Send current active and completed torrents
+        snapshot = torrent_manager.store.snapshot()
         emit('initial_data', {
-            'active_torrents': torrent_manager.active_torrents,
-            'completed_torrents': torrent_manager.completed_torrents
+            'version': snapshot.version,
+            'active_torrents': snapshot.active_dict(),
+            'completed_torrents': snapshot.completed_dict()
         })
 
     @socketio.on('disconnect')
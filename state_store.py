@@ -0,0 +1,267 @@
+# state_store.py - Thread-safe torrent state with copy-on-write snapshots
+import threading
+from types import MappingProxyType
+
+from path_index import PathIndex, split_path
+from utils import get_readable_size
+
+
+class TorrentStatus:
+    """Status record for an active torrent.
+
+    data is the JSON payload for clients, built once per update and never
+    mutated afterwards, so emits and snapshots share it without copying.
+    """
+    __slots__ = ('status', 'data')
+
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data
+
+    def to_dict(self):
+        return self.data
+
+
+class FileEntry:
+    """A single file belonging to a completed torrent"""
+    __slots__ = ('path', 'size')
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def to_dict(self):
+        """Convert the record to a JSON-serializable dict"""
+        return {
+            'path': self.path,
+            'size': self.size,
+            'size_readable': get_readable_size(self.size)
+        }
+
+
+class CompletedTorrent:
+    """Record for a finished torrent and the files kept on disk.
+
+    File paths are relative to save_path, the storage tier root holding them.
+    The files live in a PathIndex, which later records share when files are
+    detached or the torrent moves between tiers.
+    """
+    __slots__ = ('name', 'index', 'save_path')
+
+    def __init__(self, name, files=(), save_path=None, index=None):
+        self.name = name
+        self.index = index if index is not None else PathIndex(files)
+        self.save_path = save_path
+
+    @property
+    def files(self):
+        return self.index.entries()
+
+    def to_dict(self):
+        """Convert the record to a JSON-serializable dict"""
+        return {'name': self.name, 'files': [f.to_dict() for f in self.files]}
+
+
+class StateSnapshot:
+    """Immutable view of the store at a given version"""
+    __slots__ = ('version', 'active', 'completed', 'meta')
+
+    def __init__(self, version, active, completed, meta):
+        self.version = version
+        self.active = MappingProxyType(active)
+        self.completed = MappingProxyType(completed)
+        self.meta = MappingProxyType(meta)
+
+    def active_dict(self):
+        """Active torrents as plain dicts for JSON / Socket.IO payloads"""
+        return {tid: record.to_dict() for tid, record in self.active.items()}
+
+    def completed_dict(self):
+        """Completed torrents as plain dicts for JSON / Socket.IO payloads"""
+        return {tid: record.to_dict() for tid, record in self.completed.items()}
+
+
+class TorrentStore:
+    """Serializes writes to torrent state and hands out versioned snapshots.
+
+    Readers call snapshot() and get a view that never changes underneath
+    them. The first write after a snapshot was handed out copies the
+    mappings (copy-on-write); later writes, and every tick with no
+    readers, mutate in place.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._active = {}
+        self._completed = {}
+        self._meta = {}
+        self._engines = {}  # torrent_id -> (session, handle)
+        self._kept_files = set()  # torrent_ids whose data must survive removal (imports)
+        self._snapshot = None
+
+    def _begin_write(self):
+        """Detach from any published snapshot before mutating. Caller holds the lock."""
+        if self._snapshot is not None:
+            self._active = dict(self._active)
+            self._completed = dict(self._completed)
+            self._meta = dict(self._meta)
+            self._snapshot = None
+        self._version += 1
+
+    def snapshot(self):
+        """Return a consistent, read-only view of the current state"""
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = StateSnapshot(self._version, self._active, self._completed, self._meta)
+            return self._snapshot
+
+    # Active torrents
+
+    def get_status(self, torrent_id):
+        """Return the current status record for a torrent, or None"""
+        return self._active.get(torrent_id)
+
+    def is_active(self, torrent_id):
+        return torrent_id in self._active
+
+    def set_status(self, torrent_id, status, **fields):
+        """Replace the status record for a torrent and return it"""
+        # The keyword dict is ours alone, so it doubles as the client payload
+        fields['status'] = status
+        record = TorrentStatus(status, fields)
+        with self._lock:
+            self._begin_write()
+            self._active[torrent_id] = record
+        return record
+
+    def update_status(self, torrent_id, status, **fields):
+        """Set the status only if the torrent is still active. Returns None if it was cancelled."""
+        fields['status'] = status
+        record = TorrentStatus(status, fields)
+        with self._lock:
+            if torrent_id not in self._active:
+                return None
+            self._begin_write()
+            self._active[torrent_id] = record
+        return record
+
+    def remove_active(self, torrent_id):
+        """Remove a torrent from the active set and return its last status"""
+        with self._lock:
+            if torrent_id not in self._active:
+                return None
+            self._begin_write()
+            return self._active.pop(torrent_id)
+
+    # Metadata
+
+    def get_meta(self, torrent_id, default=None):
+        return self._meta.get(torrent_id, default)
+
+    def set_meta(self, torrent_id, meta):
+        with self._lock:
+            self._begin_write()
+            self._meta[torrent_id] = meta
+
+    # Completed torrents
+
+    def get_completed(self, torrent_id):
+        return self._completed.get(torrent_id)
+
+    def is_completed(self, torrent_id):
+        return torrent_id in self._completed
+
+    def set_completed(self, torrent_id, record):
+        with self._lock:
+            self._begin_write()
+            self._completed[torrent_id] = record
+
+    def remove_completed(self, torrent_id):
+        with self._lock:
+            if torrent_id not in self._completed:
+                return None
+            self._begin_write()
+            return self._completed.pop(torrent_id)
+
+    def swap_save_path(self, torrent_id, old_path, new_path):
+        """Atomically repoint a completed torrent at new_path if it is still at old_path"""
+        with self._lock:
+            record = self._completed.get(torrent_id)
+            if record is None or record.save_path != old_path:
+                return None
+            self._begin_write()
+            record = CompletedTorrent(record.name, save_path=new_path, index=record.index)
+            self._completed[torrent_id] = record
+            return record
+
+    def detach_files(self, torrent_id, folder=None, paths=None):
+        """Remove files from a completed torrent ahead of deleting them from disk.
+
+        Selects everything below folder, the given paths, or the whole torrent
+        when neither is set. Returns (entries, directories, save_path) where
+        directories are the relative folders that may be left empty, deepest
+        first, and save_path is the root the paths are relative to. The
+        torrent is dropped from the completed list once it has no files left.
+        """
+        with self._lock:
+            record = self._completed.get(torrent_id)
+            if record is None:
+                return [], [], None
+            index = record.index
+
+            if folder is not None:
+                entries = index.files_under(folder)
+                directories = index.directories_under(folder) + ['/'.join(split_path(folder))]
+            elif paths is not None:
+                entries = [entry for entry in map(index.get, paths) if entry is not None]
+                directories = []
+            else:
+                self._begin_write()
+                del self._completed[torrent_id]
+                return index.entries(), index.directories_under(), record.save_path
+            if not entries:
+                return [], directories, record.save_path
+
+            self._begin_write()
+            # Copies only the branches leading to the removed files
+            index = index.without(entry.path for entry in entries)
+            if index.is_empty():
+                del self._completed[torrent_id]
+            else:
+                self._completed[torrent_id] = CompletedTorrent(record.name, save_path=record.save_path, index=index)
+            return entries, directories, record.save_path
+
+    # libtorrent sessions and handles
+
+    def get_engine(self, torrent_id):
+        """Return the (session, handle) pair for a torrent, or None"""
+        with self._lock:
+            return self._engines.get(torrent_id)
+
+    def set_engine(self, torrent_id, session, handle, keep_files=False):
+        """Store a torrent's (session, handle) pair; keep_files marks data that must never be deleted"""
+        with self._lock:
+            self._engines[torrent_id] = (session, handle)
+            if keep_files:
+                self._kept_files.add(torrent_id)
+            else:
+                self._kept_files.discard(torrent_id)
+
+    def keeps_files(self, torrent_id):
+        """Whether removing the torrent from its session must leave its files on disk"""
+        return torrent_id in self._kept_files
+
+    def pop_engine(self, torrent_id):
+        """Atomically take ownership of a torrent's (session, handle) pair"""
+        with self._lock:
+            self._kept_files.discard(torrent_id)
+            return self._engines.pop(torrent_id, None)
+
+    def sessions(self):
+        """Return the distinct live libtorrent sessions"""
+        with self._lock:
+            unique = {}
+            for session, _ in self._engines.values():
+                unique[id(session)] = session
+            return list(unique.values())
@@ -68,6 +68,12 @@ document.addEventListener('DOMContentLoaded', function() {
         updateGlobalStats();
     });
     
+    socket.on('command_ack', function(data) {
+        if (data.status === 'failed') {
+            showToast(`Command ${data.action} failed: ${data.error}`, "error");
+        }
+    });
+    
     socket.on('completed_torrents_update', function(data) {
         updateCompletedTorrentsUI(data.torrents);
     });
@@ -328,9 +334,14 @@ document.addEventListener('DOMContentLoaded', function() {
             newHTML = `
                 <div class="card-header d-flex justify-content-between align-items-center">
                     <h5 class="mb-0">${data.meta?.name || 'Downloading...'}</h5>
-                    <button class="btn btn-sm btn-outline-danger cancel-btn" data-torrent-id="${torrentId}">
-                        Cancel
-                    </button>
+                    <div>
+                        <button class="btn btn-sm btn-outline-secondary pause-btn" data-torrent-id="${torrentId}">
+                            ${data.paused ? 'Resume' : 'Pause'}
+                        </button>
+                        <button class="btn btn-sm btn-outline-danger cancel-btn" data-torrent-id="${torrentId}">
+                            Cancel
+                        </button>
+                    </div>
                 </div>
                 <div class="card-body">
                     <div class="d-flex justify-content-between align-items-center mb-2">
@@ -369,11 +380,34 @@ document.addEventListener('DOMContentLoaded', function() {
                             <i class="bi bi-people"></i> ${data.peers || 0} peers
                         </div>
                         <div class="torrent-status-item">
-                            <i class="bi bi-info-circle"></i> ${data.state || 'Unknown'}
+                            <i class="bi bi-info-circle"></i> ${data.paused ? 'paused' : (data.state || 'Unknown')}
                         </div>
                     </div>
                 </div>
             `;
+        } else if (data.status === 'checking') {
+            torrentsInSelectionState[torrentId] = false;
+            
+            const progress = (data.progress || 0).toFixed(1);
+            
+            newHTML = `
+                <div class="card-header d-flex justify-content-between align-items-center">
+                    <h5 class="mb-0">${data.meta?.name || 'Checking...'}</h5>
+                    <button class="btn btn-sm btn-outline-danger cancel-btn" data-torrent-id="${torrentId}">
+                        Cancel
+                    </button>
+                </div>
+                <div class="card-body">
+                    <div class="d-flex justify-content-between align-items-center mb-2">
+                        <span>Checking existing files: ${progress}%</span>
+                    </div>
+                    <div class="progress">
+                        <div class="progress-bar progress-bar-striped bg-info" role="progressbar" 
+                             style="width: ${progress}%" aria-valuenow="${progress}" 
+                             aria-valuemin="0" aria-valuemax="100"></div>
+                    </div>
+                </div>
+            `;
         } else if (data.status === 'error') {
             // Reset selection state
             torrentsInSelectionState[torrentId] = false;
@@ -413,6 +447,13 @@ document.addEventListener('DOMContentLoaded', function() {
                 });
             }
             
+            const pauseBtn = torrentElement.querySelector('.pause-btn');
+            if (pauseBtn) {
+                pauseBtn.addEventListener('click', () => {
+                    sendTorrentCommand(torrentId, data.paused ? 'resume' : 'pause');
+                });
+            }
+            
             // Add other button event listeners if needed
             if (data.status === 'selection') {
                 const reopenBtn = document.getElementById(`reopen-selection-${torrentId}`);
@@ -449,6 +490,25 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
     
+    // Queue a control command (pause, resume, ...) for a running torrent
+    function sendTorrentCommand(torrentId, action, args = {}) {
+        fetch(`/api/torrent_command/${torrentId}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ action: action, args: args })
+        })
+            .then(response => response.json())
+            .then(data => {
+                if (data.status !== 'success') {
+                    showToast("Error: " + data.message, "error");
+                }
+            })
+            .catch(error => {
+                console.error('Error sending command:', error);
+                showToast("Error sending command", "error");
+            });
+    }
+    
     // File selection modal functionality
     const fileSelectionModal = new bootstrap.Modal(document.getElementById('fileSelectionModal'));
     const selectAllFiles = document.getElementById('selectAllFiles');
@@ -0,0 +1,236 @@
+# storage_tiers.py - Scratch/bulk storage tiers and background migration
+import os
+import shutil
+import threading
+import time
+
+import config
+from utils import run_blocking
+
+socketio = None
+
+# Torrents currently being migrated to bulk storage
+migrations = {}
+_migrations_lock = threading.Lock()
+
+def init_app(app_socketio):
+    """Initialize storage tiers with the app's SocketIO instance"""
+    global socketio
+    socketio = app_socketio
+
+def bulk_root():
+    return os.path.abspath(config.UPLOAD_FOLDER)
+
+def scratch_root():
+    return os.path.abspath(config.SCRATCH_FOLDER) if config.SCRATCH_FOLDER else None
+
+def download_root():
+    """Where new downloads are written: the scratch tier if configured, otherwise bulk"""
+    return scratch_root() or bulk_root()
+
+def root_for(path):
+    """Return the tier root that contains path"""
+    path = os.path.abspath(path)
+    scratch = scratch_root()
+    if scratch and (path == scratch or path.startswith(scratch + os.sep)):
+        return scratch
+    return bulk_root()
+
+def tier_name(root):
+    return 'scratch' if root == scratch_root() else 'bulk'
+
+
+class RateLimiter:
+    """Keeps the combined throughput of every caller under MIGRATION_RATE_LIMIT.
+
+    Each call reserves the next free slot of transfer time under a lock, so
+    concurrent migrations share one budget instead of each getting the full rate.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_free = time.monotonic()
+
+    def consume(self, num_bytes):
+        rate = config.MIGRATION_RATE_LIMIT
+        wait = 0
+        if rate:
+            with self._lock:
+                now = time.monotonic()
+                self._next_free = max(self._next_free, now) + num_bytes / rate
+                wait = self._next_free - now
+        # Always yield so the eventlet worker keeps serving requests, even when unlimited
+        time.sleep(max(wait, 0))
+
+
+# Shared by all migrations so the bulk tier sees at most MIGRATION_RATE_LIMIT in total
+_limiter = RateLimiter()
+
+
+def _copy_chunk(fsrc, fdst):
+    """Copy one chunk and return its size, 0 at end of file"""
+    chunk = fsrc.read(config.MIGRATION_CHUNK_SIZE)
+    if chunk:
+        fdst.write(chunk)
+    return len(chunk)
+
+def _sync_file(fdst):
+    fdst.flush()
+    os.fsync(fdst.fileno())
+
+def _copy_file(src, dst):
+    """Copy src to dst under the rate limit, making dst appear atomically"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    temp_dst = f"{dst}.migrating"
+    with open(src, 'rb') as fsrc, open(temp_dst, 'wb') as fdst:
+        while True:
+            # Only the I/O leaves the green thread; the shared limiter stays on the hub
+            size = run_blocking(_copy_chunk, fsrc, fdst)
+            if not size:
+                break
+            _limiter.consume(size)
+        run_blocking(_sync_file, fdst)
+    shutil.copystat(src, temp_dst)
+    os.replace(temp_dst, dst)
+
+def _link_file(src, dst):
+    """Hard-link src at dst; on the same filesystem this costs no data I/O"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    temp_dst = f"{dst}.migrating"
+    if os.path.exists(temp_dst):
+        os.remove(temp_dst)
+    os.link(src, temp_dst)
+    os.replace(temp_dst, dst)
+
+def _same_device(a, b):
+    try:
+        return os.stat(a).st_dev == os.stat(b).st_dev
+    except OSError:
+        return False
+
+def get_migrations():
+    """Return a copy of the progress of every running migration"""
+    with _migrations_lock:
+        return {torrent_id: dict(progress) for torrent_id, progress in migrations.items()}
+
+def emit_progress(torrent_id, data):
+    """Emit a socket.io event with migration progress"""
+    socketio.emit('migration_progress', dict(data, torrent_id=torrent_id))
+
+def schedule_migration(store, torrent_id):
+    """Migrate a completed torrent from scratch to bulk storage in the background"""
+    record = store.get_completed(torrent_id)
+    if record is None or root_for(record.save_path) == bulk_root():
+        return False
+    with _migrations_lock:
+        if torrent_id in migrations:
+            return False
+        migrations[torrent_id] = {'status': 'queued', 'copied_bytes': 0,
+                                  'total_bytes': sum(f.size for f in record.files)}
+    threading.Thread(target=migrate, args=(store, torrent_id)).start()
+    return True
+
+def migrate(store, torrent_id):
+    """Copy a torrent's files to bulk storage, then swap its library paths in one step"""
+    record = store.get_completed(torrent_id)
+    progress = migrations[torrent_id]
+    if record is None:
+        with _migrations_lock:
+            migrations.pop(torrent_id, None)
+        return
+
+    source_root = record.save_path
+    target_root = bulk_root()
+    paths = [f.path for f in record.files]
+    copied = []
+    swapped = False
+    progress['status'] = 'migrating'
+    emit_progress(torrent_id, progress)
+    print(f"Migrating {torrent_id} from {source_root} to {target_root}")
+
+    try:
+        link = _same_device(source_root, target_root)
+        last_emit_time = time.time()
+        for path in paths:
+            src = os.path.join(source_root, path)
+            dst = os.path.join(target_root, path)
+            if not os.path.isfile(src):
+                # Deleted from the library while we were migrating
+                continue
+            size = os.path.getsize(src)
+            if link:
+                _link_file(src, dst)
+                # Linking is cheap, but a large torrent still needs to yield per file
+                time.sleep(0)
+            else:
+                _copy_file(src, dst)
+            copied.append(path)
+            progress['copied_bytes'] += size
+
+            if time.time() - last_emit_time > 1:
+                emit_progress(torrent_id, progress)
+                last_emit_time = time.time()
+
+        # Point the library at bulk storage; readers see either the old or the new location
+        if store.swap_save_path(torrent_id, source_root, target_root) is None:
+            print(f"{torrent_id} was removed during migration, discarding copies")
+            for path in copied:
+                try:
+                    os.remove(os.path.join(target_root, path))
+                except OSError:
+                    pass
+        else:
+            swapped = True
+            # Files deleted from the library mid-migration must not reappear in bulk
+            current = store.get_completed(torrent_id)
+            kept = {f.path for f in current.files} if current else set()
+            for path in copied:
+                if path not in kept:
+                    try:
+                        os.remove(os.path.join(target_root, path))
+                    except OSError:
+                        pass
+
+        progress['status'] = 'completed'
+        emit_progress(torrent_id, progress)
+        print(f"Migration completed for {torrent_id}")
+
+        # Give downloads that resolved the old path a moment to open their file
+        time.sleep(config.MIGRATION_CLEANUP_DELAY)
+        for path in copied:
+            try:
+                os.remove(os.path.join(source_root, path))
+            except OSError:
+                pass
+        _prune_empty_dirs(source_root, paths)
+    except Exception as e:
+        print(f"Error migrating {torrent_id}: {e}")
+        if swapped:
+            # Only scratch cleanup failed; the bulk copy is already authoritative
+            return
+        progress['status'] = 'error'
+        progress['message'] = str(e)
+        emit_progress(torrent_id, progress)
+        # The scratch copy is still authoritative, drop partial bulk copies
+        for path in copied:
+            try:
+                os.remove(os.path.join(target_root, path))
+            except OSError:
+                pass
+    finally:
+        with _migrations_lock:
+            migrations.pop(torrent_id, None)
+
+def _prune_empty_dirs(root, paths):
+    """Remove directories under root left empty by a migration, deepest first"""
+    directories = set()
+    for path in paths:
+        directory = os.path.dirname(path)
+        while directory:
+            directories.add(directory)
+            directory = os.path.dirname(directory)
+    for directory in sorted(directories, key=lambda d: d.count(os.sep), reverse=True):
+        try:
+            os.rmdir(os.path.join(root, directory))
+        except OSError:
+            pass
@@ -3,60 +3,113 @@ import libtorrent as lt
 import os
 import time
 import threading
-import socket
 from flask_socketio import SocketIO
 
+import commands
 import config
+import dht_state
+import io_profiles
+import storage_tiers
+from state_store import TorrentStore, CompletedTorrent, FileEntry
 from utils import get_readable_size, get_eta
 
 socketio = None
 
-# Global variables to keep track of downloads
-active_torrents = {}
-completed_torrents = {}
-torrent_meta = {}
-active_sessions = {}  # Store sessions for active torrents
-active_handles = {}   # Store handles for active torrents
+# Shared torrent state (statuses, metadata, completed list, sessions/handles)
+store = TorrentStore()
+
+# Statuses in which a worker thread is polling the torrent's handle
+POLLED_STATUSES = ('metadata', 'checking', 'downloading')
 
 def init_app(app_socketio):
     """Initialize the torrent manager with the app's SocketIO instance"""
     global socketio
     socketio = app_socketio
+    
+    # Warm DHT routing state and bootstrap addresses before the first download
+    dht_state.init_app(store.sessions)
 
-def emit_torrent_update(torrent_id, data):
+def emit_torrent_update(torrent_id, record):
     """Emit a socket.io event with torrent status update"""
-    socketio.emit('torrent_update', {'torrent_id': torrent_id, 'data': data})
-
-def download_torrent(torrent_id, magnet_link=None, torrent_file=None, selected_files=None):
-    """Function to handle the torrent download process"""
-    print(f"Starting download process for {torrent_id}")
-    
-    # If we're selecting files for an existing torrent, use the stored session
-    if selected_files is not None and torrent_id in active_sessions and torrent_id in active_handles:
-        print(f"Continuing download with selected files for {torrent_id}")
-        session = active_sessions[torrent_id]
-        handle = active_handles[torrent_id]
-        start_actual_download(session, handle, torrent_id, selected_files)
+    if record is None:
+        # Torrent was cancelled while we were building the update
         return
-    
+    socketio.emit('torrent_update', {'torrent_id': torrent_id, 'data': record.to_dict()})
+
+def emit_completed_update():
+    """Emit the current completed torrents list to all clients"""
+    socketio.emit('completed_torrents_update', {'torrents': store.snapshot().completed_dict()})
+
+def build_meta(torrent_info):
+    """Build the metadata dict used for file selection"""
+    return {
+        'name': torrent_info.name(),
+        'total_size': get_readable_size(torrent_info.total_size()),
+        'files': [{
+            'path': file.path,
+            'size': file.size,
+            'size_readable': get_readable_size(file.size)
+        } for file in torrent_info.files()]
+    }
+
+def cache_metadata(torrent_info):
+    """Save a torrent's metadata so its magnet can later be imported without peers"""
+    try:
+        info_hash = str(torrent_info.info_hashes().v1)
+        path = os.path.join(config.METADATA_CACHE_FOLDER, f"{info_hash}.torrent")
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(lt.bencode(lt.create_torrent(torrent_info).generate()))
+    except Exception as e:
+        print(f"Failed to cache metadata: {e}")
+
+def load_cached_metadata(info_hash):
+    """Return the cached torrent_info for an info hash, or None"""
+    path = os.path.join(config.METADATA_CACHE_FOLDER, f"{info_hash}.torrent")
+    if not os.path.exists(path):
+        return None
+    return lt.torrent_info(path)
+
+def create_session(extra_settings=None):
+    """Create a libtorrent session with the app settings and DHT bootstrap nodes"""
     # Configure session with more aggressive settings for metadata retrieval
     settings = dict(config.DEFAULT_TORRENT_SETTINGS)
     settings['alert_mask'] = lt.alert.category_t.all_categories
+    settings.update(io_profiles.get_settings())
+    if extra_settings:
+        settings.update(extra_settings)
     
     session = lt.session(settings)
+    
+    # Start from the saved routing table instead of an empty one
+    if dht_state.apply_state(session):
+        print("Loaded saved DHT routing state into session")
+    
     session.start_dht()
     session.start_lsd()
     session.start_upnp()
     session.start_natpmp()
     
-    # Add DHT nodes directly for better connectivity
-    for hostname, port in config.DHT_NODES:
-        try:
-            ip = socket.gethostbyname(hostname)
-            print(f"Adding DHT node: {hostname} ({ip}:{port})")
-            session.add_dht_node((ip, port))
-        except Exception as e:
-            print(f"Failed to add DHT node {hostname}: {e}")
+    # Add cached DHT node addresses directly for better connectivity; they are
+    # resolved in the background, so this never waits on DNS
+    for ip, port in dht_state.get_bootstrap_nodes():
+        session.add_dht_node((ip, port))
+    
+    return session
+
+def download_torrent(torrent_id, magnet_link=None, torrent_file=None, selected_files=None):
+    """Function to handle the torrent download process"""
+    print(f"Starting download process for {torrent_id}")
+    
+    # If we're selecting files for an existing torrent, use the stored session
+    engine = store.get_engine(torrent_id)
+    if selected_files is not None and engine is not None:
+        print(f"Continuing download with selected files for {torrent_id}")
+        session, handle = engine
+        start_actual_download(session, handle, torrent_id, selected_files)
+        return
+    
+    session = create_session()
     
     # Add the torrent
     params = None
@@ -68,27 +121,24 @@ def download_torrent(torrent_id, magnet_link=None, torrent_file=None, selected_f
         params.ti = info
     
     if not params:
-        status_data = {'status': 'error', 'message': 'Invalid torrent source'}
-        active_torrents[torrent_id] = status_data
-        emit_torrent_update(torrent_id, status_data)
+        emit_torrent_update(torrent_id, store.set_status(torrent_id, 'error', message='Invalid torrent source'))
         return
     
-    # Set the save path directly on params
-    params.save_path = os.path.abspath(config.UPLOAD_FOLDER)
+    # Set the save path directly on params; new downloads go to the fastest tier
+    params.save_path = storage_tiers.download_root()
     
     # Add torrent to session
     handle = session.add_torrent(params)
     
     # Store the session and handle for later use
-    active_sessions[torrent_id] = session
-    active_handles[torrent_id] = handle
+    store.set_engine(torrent_id, session, handle)
+    
+    # Register the torrent so later steps only update it while it is not cancelled
+    emit_torrent_update(torrent_id, store.set_status(torrent_id, 'metadata', progress=0))
     
     # Wait for metadata if it's a magnet link
     if magnet_link:
         print(f"Magnet link provided. Downloading metadata for {torrent_id}")
-        status_data = {'status': 'metadata', 'progress': 0}
-        active_torrents[torrent_id] = status_data
-        emit_torrent_update(torrent_id, status_data)
         
         # More robust metadata waiting with timeout and alert processing
         metadata_timeout = time.time() + config.METADATA_TIMEOUT
@@ -117,14 +167,13 @@ def download_torrent(torrent_id, magnet_link=None, torrent_file=None, selected_f
             
             # Emit status update every second
             if current_time - last_emit_time > 1:
-                status_data = {
-                    'status': 'metadata', 
-                    'progress': 0,
-                    'peers': status.num_peers,
-                    'state': str(status.state)
-                }
-                active_torrents[torrent_id] = status_data
-                emit_torrent_update(torrent_id, status_data)
+                record = store.update_status(
+                    torrent_id, 'metadata',
+                    progress=0,
+                    peers=status.num_peers,
+                    state=str(status.state)
+                )
+                emit_torrent_update(torrent_id, record)
                 last_emit_time = current_time
             
             # Check for metadata in a way that works across different libtorrent versions
@@ -141,28 +190,17 @@ def download_torrent(torrent_id, magnet_link=None, torrent_file=None, selected_f
                     # Extra verification that we can actually access the torrent_file
                     torrent_info = handle.torrent_file()
                     if torrent_info:
-                        name = torrent_info.name()
-                        file_storage = torrent_info.files()
-                        
                         # Store metadata for file selection
-                        torrent_meta[torrent_id] = {
-                            'name': name,
-                            'total_size': get_readable_size(torrent_info.total_size()),
-                            'files': [{
-                                'path': file.path,
-                                'size': file.size,
-                                'size_readable': get_readable_size(file.size)
-                            } for file in file_storage]
-                        }
+                        meta = build_meta(torrent_info)
+                        store.set_meta(torrent_id, meta)
+                        cache_metadata(torrent_info)
                         
                         print(f"Metadata successfully retrieved for {torrent_id}")
                         
                         # Move to file selection or start download
-                        if selected_files is None and len(torrent_meta[torrent_id]['files']) > 1:
+                        if selected_files is None and len(meta['files']) > 1:
                             # If there are multiple files and no selection made, move to selection state
-                            status_data = {'status': 'selection', 'meta': torrent_meta[torrent_id]}
-                            active_torrents[torrent_id] = status_data
-                            emit_torrent_update(torrent_id, status_data)
+                            emit_torrent_update(torrent_id, store.update_status(torrent_id, 'selection', meta=meta))
                             # Keep session and handle in memory to avoid redownloading metadata
                             # We'll return here and wait for the user to select files
                             return
@@ -177,51 +215,181 @@ def download_torrent(torrent_id, magnet_link=None, torrent_file=None, selected_f
                 
             time.sleep(0.1)  # Shorter sleep time for more responsive UI
             
-            if torrent_id not in active_torrents:
+            if not store.is_active(torrent_id):
                 # Download was cancelled
                 print(f"Download cancelled for {torrent_id}")
-                session.remove_torrent(handle, True)
+                if store.pop_engine(torrent_id):
+                    session.remove_torrent(handle, True)
                 return
                 
             # Check for timeout
             if time.time() > metadata_timeout:
                 print(f"Metadata download timed out for {torrent_id}")
-                status_data = {'status': 'error', 'message': 'Metadata download timed out. Please try again or use a different torrent.'}
-                active_torrents[torrent_id] = status_data
-                emit_torrent_update(torrent_id, status_data)
-                session.remove_torrent(handle, True)
+                # Release the handle before publishing the error so a cancel cannot find it
+                if store.pop_engine(torrent_id):
+                    session.remove_torrent(handle, True)
+                record = store.update_status(torrent_id, 'error', message='Metadata download timed out. Please try again or use a different torrent.')
+                emit_torrent_update(torrent_id, record)
                 return
     else:
         # For torrent files that already have metadata
         torrent_info = handle.torrent_file()
-        name = torrent_info.name()
-        file_storage = torrent_info.files()
         
         # Store metadata for file selection
-        torrent_meta[torrent_id] = {
-            'name': name,
-            'total_size': get_readable_size(torrent_info.total_size()),
-            'files': [{
-                'path': file.path,
-                'size': file.size,
-                'size_readable': get_readable_size(file.size)
-            } for file in file_storage]
-        }
+        meta = build_meta(torrent_info)
+        store.set_meta(torrent_id, meta)
+        cache_metadata(torrent_info)
         
         # Move to file selection or start download
-        if selected_files is None and len(torrent_meta[torrent_id]['files']) > 1:
+        if selected_files is None and len(meta['files']) > 1:
             # If there are multiple files and no selection made, move to selection state
-            status_data = {'status': 'selection', 'meta': torrent_meta[torrent_id]}
-            active_torrents[torrent_id] = status_data
-            emit_torrent_update(torrent_id, status_data)
+            emit_torrent_update(torrent_id, store.update_status(torrent_id, 'selection', meta=meta))
             return
         else:
             # If files were pre-selected or there's only one file, start downloading
             start_actual_download(session, handle, torrent_id, selected_files)
             return
 
+def import_torrent(torrent_id, magnet_link=None, torrent_file=None, hashing_threads=None):
+    """Adopt data already under UPLOAD_FOLDER: recheck it and download only what is missing"""
+    print(f"Starting import for {torrent_id}")
+    
+    try:
+        # Resolve metadata up front; a magnet can only be imported from the cache
+        if torrent_file:
+            torrent_info = lt.torrent_info(torrent_file)
+        else:
+            magnet_params = lt.parse_magnet_uri(magnet_link)
+            torrent_info = load_cached_metadata(str(magnet_params.info_hashes.v1))
+            if torrent_info is None:
+                raise ValueError('No cached metadata for this magnet link. Add it as a normal download instead.')
+    except Exception as e:
+        emit_torrent_update(torrent_id, store.set_status(torrent_id, 'error', message=str(e)))
+        return
+    
+    # More hashing threads and checking memory let the recheck use every core
+    hashing_threads = hashing_threads or config.IMPORT_HASHING_THREADS
+    session = create_session({
+        'hashing_threads': hashing_threads,
+        'checking_mem_usage': config.IMPORT_CHECKING_MEM_USAGE
+    })
+    
+    params = lt.add_torrent_params()
+    params.ti = torrent_info
+    params.save_path = storage_tiers.bulk_root()
+    handle = session.add_torrent(params)
+    # Adopted data is never deleted, whoever removes the torrent
+    store.set_engine(torrent_id, session, handle, keep_files=True)
+    
+    meta = build_meta(torrent_info)
+    store.set_meta(torrent_id, meta)
+    cache_metadata(torrent_info)
+    
+    print(f"Rechecking existing data for {torrent_id} with {hashing_threads} hashing threads")
+    emit_torrent_update(torrent_id, store.set_status(torrent_id, 'checking', progress=0, meta=meta))
+    handle.force_recheck()
+    
+    last_emit_time = time.time()
+    checked = False
+    
+    # Accept pause/resume/recheck commands while checking
+    commands.open_queue(torrent_id)
+    
+    try:
+        while not checked:
+            alerts = session.pop_alerts()
+            commands.handle_alerts(torrent_id, alerts)
+            for alert in alerts:
+                if isinstance(alert, lt.torrent_checked_alert):
+                    checked = True
+                elif "error" in type(alert).__name__.lower():
+                    print(f"Alert: {type(alert).__name__} - {alert.message()}")
+            
+            if not store.is_active(torrent_id):
+                # Import was cancelled; never delete adopted data
+                print(f"Import cancelled for {torrent_id}")
+                commands.close_queue(torrent_id)
+                if store.pop_engine(torrent_id):
+                    session.remove_torrent(handle)
+                return
+            
+            s = handle.status()
+            
+            current_time = time.time()
+            if current_time - last_emit_time > 0.5:
+                record = store.update_status(
+                    torrent_id, 'checking',
+                    progress=s.progress * 100,
+                    state=str(s.state),
+                    paused=s.paused,
+                    meta=meta
+                )
+                emit_torrent_update(torrent_id, record)
+                last_emit_time = current_time
+            
+            # Apply queued commands, or wait for the next tick
+            commands.process(torrent_id, handle)
+    except Exception as e:
+        print(f"Error during recheck: {e}")
+        commands.close_queue(torrent_id)
+        if store.pop_engine(torrent_id):
+            session.remove_torrent(handle)
+        emit_torrent_update(torrent_id, store.update_status(torrent_id, 'error', message=str(e)))
+        return
+    
+    s = handle.status()
+    print(f"Recheck finished for {torrent_id}: {s.progress * 100:.1f}% present")
+    
+    # Download only the missing or corrupt pieces
+    start_actual_download(session, handle, torrent_id)
+
+def mark_completed(torrent_id, handle):
+    """Move a finished torrent into the completed list and notify clients"""
+    torrent_info = handle.torrent_file()
+    if torrent_info:
+        file_storage = torrent_info.files()
+        priorities = handle.get_file_priorities()
+        
+        # Library paths are relative to the storage tier root, even if storage was moved
+        save_path = os.path.abspath(handle.status().save_path)
+        root = storage_tiers.root_for(save_path)
+        subdir = os.path.relpath(save_path, root)
+        
+        files = []
+        for i in range(file_storage.num_files()):
+            # Files the user deselected (priority 0) were never downloaded
+            if priorities[i] > 0:
+                file_info = file_storage.at(i)
+                files.append(FileEntry(os.path.normpath(os.path.join(subdir, file_info.path)), file_info.size))
+        store.set_completed(torrent_id, CompletedTorrent(torrent_info.name(), files, root))
+    
+    emit_torrent_update(torrent_id, store.update_status(torrent_id, 'completed'))
+    
+    # Also emit a completed_torrents_update event to refresh the completed torrents list
+    emit_completed_update()
+    
+    # Finished downloads on the scratch tier move to bulk storage in the background
+    if storage_tiers.schedule_migration(store, torrent_id):
+        print(f"Scheduled migration to bulk storage for {torrent_id}")
+
+def release_engine(torrent_id, session, handle):
+    """Take the torrent's engine entry if we still own it and remove it from the session, keeping files"""
+    try:
+        if store.pop_engine(torrent_id):
+            session.remove_torrent(handle)
+            print(f"Torrent removed from session for {torrent_id}")
+    except Exception as e:
+        print(f"Error removing torrent: {e}")
+
 def start_actual_download(session, handle, torrent_id, selected_files=None):
     """Start the actual download using the existing session and handle"""
+    if store.get_engine(torrent_id) is None:
+        # Cancelled while waiting in the selection state
+        print(f"No engine for {torrent_id}, download was cancelled")
+        return
+    # Imports adopted existing data, which a cancel must leave on disk
+    keep_files = store.keeps_files(torrent_id)
+
     try:
         # Set file priorities if provided
         if selected_files is not None:
@@ -235,18 +403,27 @@ def start_actual_download(session, handle, torrent_id, selected_files=None):
                 handle.prioritize_files(file_priorities)
                 print(f"Set file priorities for {torrent_id}: {file_priorities}")
         
-        # Start downloading
-        status_data = {
-            'status': 'downloading',
-            'progress': 0,
-            'download_rate': 0,
-            'upload_rate': 0,
-            'peers': 0,
-            'state': 'starting',
-            'meta': torrent_meta.get(torrent_id, {'name': 'Unknown'})
-        }
-        active_torrents[torrent_id] = status_data
-        emit_torrent_update(torrent_id, status_data)
+        # Start downloading, unless the torrent was cancelled after the metadata,
+        # selection or checking step
+        meta = store.get_meta(torrent_id, {'name': 'Unknown'})
+        record = store.update_status(
+            torrent_id, 'downloading',
+            progress=0,
+            download_rate=0,
+            upload_rate=0,
+            peers=0,
+            state='starting',
+            meta=meta
+        )
+        if record is None:
+            print(f"Download cancelled for {torrent_id}")
+            if store.pop_engine(torrent_id):
+                session.remove_torrent(handle, not keep_files)
+            return
+        emit_torrent_update(torrent_id, record)
+        
+        # Accept control commands from the API from here on
+        commands.open_queue(torrent_id)
         
         print(f"Starting download for {torrent_id}")
         
@@ -254,89 +431,72 @@ def start_actual_download(session, handle, torrent_id, selected_files=None):
         last_emit_time = time.time()
         
         while True:
+            # Check if download was cancelled
+            if not store.is_active(torrent_id):
+                print(f"Download cancelled for {torrent_id}")
+                # Only the owner of the engine entry removes the torrent
+                if store.pop_engine(torrent_id):
+                    session.remove_torrent(handle, not keep_files)
+                return
+            
+            # Acknowledge storage moves once libtorrent reports their outcome
+            commands.handle_alerts(torrent_id, session.pop_alerts())
+            
             s = handle.status()
             
             current_time = time.time()
             # Emit status update every 0.5 seconds for more responsive UI
             if current_time - last_emit_time > 0.5:
-                status_data = {
-                    'status': 'downloading',
-                    'progress': s.progress * 100,
-                    'download_rate': get_readable_size(s.download_rate),
-                    'upload_rate': get_readable_size(s.upload_rate),
-                    'peers': s.num_peers,
-                    'state': str(s.state),
-                    'meta': torrent_meta.get(torrent_id, {'name': 'Unknown'}),
-                    'bytes_downloaded': s.total_done,
-                    'total_bytes': s.total_wanted,
-                    'bytes_downloaded_readable': get_readable_size(s.total_done),
-                    'total_bytes_readable': get_readable_size(s.total_wanted),
-                    'eta': get_eta(s.download_rate, s.total_wanted - s.total_done) if s.download_rate > 0 else "∞"
-                }
-                active_torrents[torrent_id] = status_data
-                emit_torrent_update(torrent_id, status_data)
+                record = store.update_status(
+                    torrent_id, 'downloading',
+                    progress=s.progress * 100,
+                    download_rate=get_readable_size(s.download_rate),
+                    upload_rate=get_readable_size(s.upload_rate),
+                    peers=s.num_peers,
+                    state=str(s.state),
+                    paused=s.paused,
+                    meta=meta,
+                    bytes_downloaded=s.total_done,
+                    total_bytes=s.total_wanted,
+                    bytes_downloaded_readable=get_readable_size(s.total_done),
+                    total_bytes_readable=get_readable_size(s.total_wanted),
+                    eta=get_eta(s.download_rate, s.total_wanted - s.total_done) if s.download_rate > 0 else "∞"
+                )
+                emit_torrent_update(torrent_id, record)
                 last_emit_time = current_time
             
-            # Check if download was cancelled
-            if torrent_id not in active_torrents:
-                print(f"Download cancelled for {torrent_id}")
-                session.remove_torrent(handle, True)
-                # Clean up stored session and handle
-                if torrent_id in active_sessions:
-                    del active_sessions[torrent_id]
-                if torrent_id in active_handles:
-                    del active_handles[torrent_id]
-                return
-            
-            # Check if download is completed
-            if s.progress >= 1.0:
+            # Check if download is completed; wait for a running move so the
+            # library records the final save path
+            if s.progress >= 1.0 and not commands.move_in_progress(torrent_id):
                 print(f"Download completed for {torrent_id}")
                 
-                # Add to completed torrents list
-                torrent_info = handle.torrent_file()
-                if torrent_info:
-                    file_storage = torrent_info.files()
-                    completed_torrents[torrent_id] = {
-                        'name': torrent_info.name(),
-                        'files': []
-                    }
-                    
-                    for i in range(file_storage.num_files()):
-                        if selected_files is None or i in selected_files:
-                            file_info = file_storage.at(i)
-                            completed_torrents[torrent_id]['files'].append({
-                                'path': file_info.path,
-                                'size': file_info.size,
-                                'size_readable': get_readable_size(file_info.size)
-                            })
+                # Take the session and handle out of the store before 'completed' is
+                # public, so a cancel can never remove the files of a library torrent
+                if not store.pop_engine(torrent_id):
+                    return
                 
-                status_data = {'status': 'completed'}
-                active_torrents[torrent_id] = status_data
-                emit_torrent_update(torrent_id, status_data)
+                # Add to completed torrents list
+                mark_completed(torrent_id, handle)
                 
-                # Also emit a completed_torrents_update event to refresh the completed torrents list
-                socketio.emit('completed_torrents_update', {'torrents': completed_torrents})
+                # Keep the routing table this session built up for the next one
+                try:
+                    dht_state.save_state(session)
+                except Exception as e:
+                    print(f"Failed to save DHT state: {e}")
                 
-                # Clean up stored session and handle
-                if torrent_id in active_sessions:
-                    del active_sessions[torrent_id]
-                if torrent_id in active_handles:
-                    del active_handles[torrent_id]
+                session.remove_torrent(handle)
                 break
             
-            time.sleep(0.1)  # Shorter sleep time for more responsive UI
+            # Apply queued commands as they arrive; otherwise wait for the next tick
+            commands.process(torrent_id, handle)
     
     except Exception as e:
         error_msg = str(e)
         print(f"Error in download process: {error_msg}")
-        status_data = {'status': 'error', 'message': error_msg}
-        active_torrents[torrent_id] = status_data
-        emit_torrent_update(torrent_id, status_data)
+        # Release the handle before publishing the error so a cancel cannot find it
+        release_engine(torrent_id, session, handle)
+        emit_torrent_update(torrent_id, store.update_status(torrent_id, 'error', message=error_msg))
     finally:
         # Cleanup
-        try:
-            if torrent_id in active_sessions and torrent_id in active_handles:
-                session.remove_torrent(handle)
-                print(f"Torrent removed from session for {torrent_id}")
-        except Exception as e:
-            print(f"Error removing torrent: {e}")
\ No newline at end of file
+        commands.close_queue(torrent_id)
+        release_engine(torrent_id, session, handle)
\ No newline at end of file
@@ -4,6 +4,8 @@ import shutil
 import tempfile
 import zipfile
 
+from eventlet import patcher, tpool
+
 def get_readable_size(size_bytes):
     """Convert bytes to human-readable format"""
     if size_bytes == 0:
@@ -58,4 +60,11 @@ def cleanup_dir(directory):
     try:
         shutil.rmtree(directory, ignore_errors=True)
     except Exception as e:
-        print(f"Error cleaning up directory: {e}")
\ No newline at end of file
+        print(f"Error cleaning up directory: {e}")
+
+def run_blocking(func, *args):
+    """Run blocking file I/O in a real OS thread when eventlet has patched threads"""
+    if patcher.is_monkey_patched('thread'):
+        # A green thread doing this directly would stall every request and torrent loop
+        return tpool.execute(func, *args)
+    return func(*args)